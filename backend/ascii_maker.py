@@ -1,8 +1,256 @@
-from PIL import Image, ImageEnhance, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
-from typing import Dict, List
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, suppress
+from functools import lru_cache
+import logging
 import os
+import queue
+import shutil
+import subprocess
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# 导出帧文件名模板
+FRAME_NAME_TEMPLATE = 'frame_{:06d}.txt'
+
+# 帧ZIP的压缩级别：ASCII文本重复度高，1级的压缩率与默认6级相差不大，速度快得多
+ZIP_COMPRESS_LEVEL = 1
+
+# ffmpeg H.264 编码器候选及其参数：优先硬件编码（NVIDIA/macOS/Intel），都不可用时用 libx264 软件编码
+FFMPEG_ENCODERS = {
+    'h264_nvenc': ['-preset', 'p1'],
+    'h264_videotoolbox': [],
+    'h264_qsv': ['-preset', 'veryfast'],
+    'libx264': ['-preset', 'veryfast'],
+}
+
+# 字符像素尺寸
+CHAR_WIDTH = 8
+CHAR_HEIGHT = 14
+
+
+@lru_cache(maxsize=8)
+def _char_lut(chars: str) -> np.ndarray:
+    """亮度(0-255) -> 字符编码 查找表，同一字符集的转换器共用"""
+    char_indices = (np.arange(256) * (len(chars) - 1)) // 255
+    lut = np.frombuffer(chars.encode('ascii'), dtype=np.uint8)[char_indices]
+    lut.flags.writeable = False
+    return lut
+
+
+@lru_cache(maxsize=1024)
+def _contrast_char_lut(chars: str, contrast: float, mean: int) -> np.ndarray:
+    """折算了对比度调整的 亮度->字符编码 查找表
+    
+    以平均灰度为中心线性拉伸，截断到0-255（与 ImageEnhance.Contrast 的公式相同）。
+    注意拉伸作用在灰度上，而以前的 ImageEnhance.Contrast 是先逐个RGB通道拉伸截断、再转灰度：
+    灰度图结果一致，彩色图（尤其饱和色）在对比度不为1时部分字符会不同，这是有意的取舍。
+    平均灰度只有256种取值，相邻帧大多相同，按 (字符集, 对比度, 平均灰度) 缓存
+    """
+    levels = np.arange(256, dtype=np.float32)
+    adjusted = np.clip(mean + contrast * (levels - mean), 0, 255).astype(np.uint8)
+    lut = _char_lut(chars)[adjusted]
+    lut.flags.writeable = False
+    return lut
+
+
+@lru_cache(maxsize=8)
+def _color_lut(color_bgr: Tuple[int, int, int]) -> np.ndarray:
+    """笔画强度(0-255) -> BGR颜色 查找表，同一颜色的转换器共用"""
+    intensity = np.arange(256, dtype=np.uint32)[:, None]
+    lut = ((intensity * color_bgr + 127) // 255).astype(np.uint8).reshape(256, 1, 3)
+    lut.flags.writeable = False
+    return lut
+
+
+@lru_cache(maxsize=None)
+def _glyph_layers() -> List[Tuple[int, int, np.ndarray]]:
+    """预渲染所有可打印ASCII字符的字形图集
+    
+    字形可能超出自身 8x14 的格子，因此在 3x3 格子的画布中渲染，
+    按相对偏移 (dy, dx) 拆分为多层，每层形状为 (128, 字符高)，元素为一行
+    字符宽个像素的笔画强度 0-255。第一层为 (0, 0)，其余只返回非空的层。
+    """
+    canvas = np.zeros((128, 3 * CHAR_HEIGHT, 3 * CHAR_WIDTH), dtype=np.uint8)
+    for code in range(32, 127):
+        cv2.putText(
+            canvas[code],
+            chr(code),
+            (CHAR_WIDTH, 2 * CHAR_HEIGHT - 4),
+            cv2.FONT_HERSHEY_PLAIN,
+            1.0,
+            255,
+            1
+        )
+    
+    # 每个字形行的 CHAR_WIDTH 个像素打包成一个元素，拼接时按整行搬运
+    row_dtype = np.dtype((np.void, CHAR_WIDTH))
+    
+    # 字形自身格子 (0, 0) 排在最前且总是保留，渲染时作为底层直接覆盖写入
+    offsets = [(0, 0)] + [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy, dx) != (0, 0)]
+    
+    layers = []
+    for dy, dx in offsets:
+        layer = canvas[:, (dy + 1) * CHAR_HEIGHT:(dy + 2) * CHAR_HEIGHT,
+                          (dx + 1) * CHAR_WIDTH:(dx + 2) * CHAR_WIDTH]
+        if (dy, dx) == (0, 0) or layer.any():
+            rows = np.ascontiguousarray(layer).view(row_dtype).reshape(128, CHAR_HEIGHT)
+            layers.append((dy, dx, rows))
+    return layers
+
+
+_ffmpeg_encoder_lock = threading.Lock()
+
+
+def detect_ffmpeg_encoder() -> Optional[str]:
+    """可用的 ffmpeg H.264 编码器，没有 ffmpeg 或都不可用时返回 None
+    
+    整个进程只探测一次：并发调用时后来者等待第一次探测的结果。
+    探测需要逐个试编码，服务启动时可提前在后台调用，避免第一次导出等待
+    """
+    with _ffmpeg_encoder_lock:
+        return _probe_ffmpeg_encoder()
+
+
+@lru_cache(maxsize=None)
+def _probe_ffmpeg_encoder() -> Optional[str]:
+    """逐个试编码一小段，返回第一个可用的编码器
+    
+    编码器已编译但没有对应硬件时只有实际编码才会失败
+    """
+    if shutil.which('ffmpeg') is None:
+        return None
+    
+    for encoder in FFMPEG_ENCODERS:
+        command = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+            '-c:v', encoder, *FFMPEG_ENCODERS[encoder], '-pix_fmt', 'yuv420p', '-f', 'null', '-'
+        ]
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if result.returncode == 0:
+            logger.info("ffmpeg H.264 encoder: %s", encoder)
+            return encoder
+    return None
+
+
+# 逐帧转换/渲染线程池（所有请求共享，同时导出多个视频时总线程数也不超过CPU核数）。
+# 只执行单帧任务，任务内不再等待本线程池，调用方都在线程池之外，不会互相等待而死锁
+FRAME_WORKERS = os.cpu_count() or 1
+_frame_pool = ThreadPoolExecutor(max_workers=FRAME_WORKERS, thread_name_prefix='ascii-frame')
+
+
+def _ordered_map(func: Callable, items) -> Iterator:
+    """在共享的逐帧线程池中并行执行 func(item)，按输入顺序逐个产出结果
+    
+    适用于主要耗时在释放GIL的OpenCV/NumPy运算的任务；在途任务数有上限以控制内存
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(_frame_pool.submit(func, item))
+            if len(pending) >= 2 * FRAME_WORKERS:
+                yield pending.popleft().result()
+        
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # 提前结束时取消排队中的任务，并等待已开始的任务结束
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+def file_cache_key(path: str) -> Optional[Tuple[str, int, int]]:
+    """以 (绝对路径, 修改时间, 大小) 标识文件内容，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _open_capture(video_path: str) -> cv2.VideoCapture:
+    """打开视频，支持时请求硬件加速解码（NVDEC/VAAPI/D3D11等）
+    
+    没有可用的硬件设备时 OpenCV 自动退回软件解码；后端不接受该参数时按默认方式重新打开
+    """
+    acceleration = getattr(cv2, 'VIDEO_ACCELERATION_ANY', None)
+    if acceleration is not None:
+        cap = cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_HW_ACCELERATION, acceleration])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(video_path)
+
+
+class _FFmpegWriter:
+    """通过管道把BGR帧交给 ffmpeg 编码为 H.264 MP4，接口与 cv2.VideoWriter 一致"""
+    
+    def __init__(self, output_path: str, encoder: str, fps: float, frame_size: Tuple[int, int]):
+        width, height = frame_size
+        command = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            '-c:v', encoder, *FFMPEG_ENCODERS[encoder], '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+            output_path
+        ]
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        except OSError:
+            self._process = None
+    
+    def isOpened(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+    
+    def write(self, image: np.ndarray):
+        # 帧数据直接写入管道，不额外复制
+        self._process.stdin.write(np.ascontiguousarray(image).data)
+    
+    def release(self):
+        """结束输入并等待编码完成，编码失败时抛出异常（重复调用无效果）"""
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if process.wait() != 0:
+            raise Exception("视频编码失败")
+
+
+class _ChunkSink:
+    """只写的类文件对象（不可定位），收集写入的数据供生成器分块取出"""
+    
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self) -> bytes:
+        """取出并清空已收集的数据"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
 
 class ImageToASCII:
     """图片转ASCII核心转换器"""
@@ -30,109 +278,199 @@ class ImageToASCII:
         self.contrast = contrast
         self.color = color
         self.color_rgb = self.COLORS.get(color, self.COLORS['white'])
+        self.color_bgr = self.color_rgb[::-1]  # OpenCV绘制使用BGR
+        
+        # 笔画强度(0-255) -> BGR颜色 查找表
+        self._color_lut = _color_lut(self.color_bgr)
+        
+        # 上次渲染的 (文本, 尺寸, 图像)，相邻帧相同时复用
+        self._last_render = None
+        # 渲染中间缓冲区（每个线程各一份，逐帧复用）
+        self._render_local = threading.local()
+        
+        # 亮度(0-255) -> 字符 查找表
+        self._lut = _char_lut(self.chars)
     
-    def resize_image(self, image: Image.Image) -> Image.Image:
-        """调整图片尺寸，保持宽高比"""
-        original_width, original_height = image.size
+    def target_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """根据原始尺寸计算缩放后的尺寸，保持宽高比"""
+        original_width, original_height = size
         aspect_ratio = original_height / original_width
         new_height = int(self.width * aspect_ratio * self.scale)
-        return image.resize((self.width, new_height))
-    
-    def adjust_image(self, image: Image.Image) -> Image.Image:
-        """调整对比度"""
-        if self.contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(self.contrast)
-        return image
+        return (self.width, new_height)
     
-    def get_char(self, brightness: int) -> str:
-        """根据亮度值获取对应的ASCII字符"""
-        char_index = int((brightness / 255) * (len(self.chars) - 1))
-        return self.chars[char_index]
+    def resize_image(self, image: Image.Image) -> Image.Image:
+        """调整图片尺寸，保持宽高比"""
+        return image.resize(self.target_size(image.size))
     
-    def convert_to_ascii(self, image_path: str) -> str:
-        """转换为ASCII文本"""
-        # 打开图片
-        image = Image.open(image_path)
+    def load_grayscale(self, image_path: str) -> np.ndarray:
+        """打开图片，得到缩放后的灰度图
         
-        # 调整尺寸
-        image = self.resize_image(image)
+        先转灰度再缩放，只需缩放单通道
+        """
+        # 只读取文件头，得到格式和原始尺寸
+        image = Image.open(image_path)
+        new_size = self.target_size(image.size)
+        
+        if image.format != 'JPEG':
+            # 其他格式用 OpenCV 直接解码为灰度（比 Pillow 快），再 INTER_AREA 缩放
+            # （不用 IMREAD_REDUCED_*：非JPEG格式是完整解码后再线性插值缩小，细节多的图会产生混叠）
+            flags = cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION
+            gray = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), flags)
+            if gray is not None:
+                image.close()
+                return cv2.resize(gray, new_size, interpolation=cv2.INTER_AREA)
+        
+        # JPEG 尚未解码时，让解码器直接按 1/2~1/8 缩小并只解码灰度，
+        # 大图可省去绝大部分解码工作；OpenCV 不支持的格式同样走 Pillow。
+        # draft 缩小后的尺寸是向上取整的，必须缩放到按原始尺寸算出的 new_size，否则行数可能变化
+        image.draft('L', new_size)
+        
+        return np.asarray(image.convert('L').resize(new_size))
+    
+    def contrast_lut(self, mean: int) -> np.ndarray:
+        """把对比度调整折算进亮度->字符查找表（以平均灰度为中心）"""
+        return _contrast_char_lut(self.chars, self.contrast, mean)
+    
+    def gray_to_ascii(self, grayscale_image: np.ndarray, out: np.ndarray = None) -> str:
+        """将灰度图按查找表一次性映射为ASCII文本"""
+        return self.gray_to_bytes(grayscale_image, out).decode('ascii')
+    
+    def gray_to_bytes(self, grayscale_image: np.ndarray, out: np.ndarray = None) -> bytes:
+        """将灰度图按查找表一次性映射为ASCII字节串（写文件时无需再编码）
         
-        # 调整对比度
-        image = self.adjust_image(image)
+        out 为可复用的 (高, 宽+1) uint8 缓冲区，最后一列需预先填好换行符
+        """
+        arr = np.asarray(grayscale_image, dtype=np.uint8)
+        height, width = arr.shape
         
-        # 转换为灰度图
-        grayscale_image = image.convert('L')
+        # 调整对比度（直接折算进查找表，省去一次整图处理）
+        lut = self._lut
+        if self.contrast != 1.0:
+            lut = self.contrast_lut(int(cv2.mean(arr)[0] + 0.5))
+        
+        # 每行末尾追加一列换行符，cv2.LUT 一次查表写入字符编码，整块转为字节
+        if out is None:
+            out = np.empty((height, width + 1), dtype=np.uint8)
+            out[:, width] = ord('\n')
+        cv2.LUT(arr, lut, dst=out[:, :width])
+        return out.tobytes()
+    
+    def convert_to_ascii(self, image_path: str) -> str:
+        """转换为ASCII文本"""
+        # 打开图片，转换为缩放后的灰度图
+        grayscale_image = self.load_grayscale(image_path)
         
         # 转换为ASCII
-        ascii_str = ""
-        for y in range(grayscale_image.height):
-            for x in range(grayscale_image.width):
-                brightness = grayscale_image.getpixel((x, y))
-                char = self.get_char(brightness)
-                ascii_str += char
-            ascii_str += '\n'
-        
-        return ascii_str
+        return self.gray_to_ascii(grayscale_image)
     
     def export_image_to_png(self, image_path: str, output_path: str):
         """将图片转换为ASCII PNG"""
         # 打开并处理图片
-        image = Image.open(image_path)
-        image = self.resize_image(image)
-        image = self.adjust_image(image)
-        grayscale_image = image.convert('L')
-        
-        # 计算ASCII尺寸
-        ascii_lines = []
-        for y in range(grayscale_image.height):
-            line = ""
-            for x in range(grayscale_image.width):
-                brightness = grayscale_image.getpixel((x, y))
-                char = self.get_char(brightness)
-                line += char
-            ascii_lines.append(line)
-        
-        ascii_height = len(ascii_lines)
-        ascii_width = max(len(line) for line in ascii_lines) if ascii_lines else 0
-        
-        # 字符像素尺寸
-        char_width = 8
-        char_height = 14
-        
-        frame_width = ascii_width * char_width
-        frame_height = ascii_height * char_height
-        
-        # 创建图像
-        img = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
-        
-        # 渲染ASCII
-        for y, line in enumerate(ascii_lines):
-            line = line.ljust(ascii_width)[:ascii_width]
-            for x, char in enumerate(line):
-                if x >= ascii_width:
-                    break
-                try:
-                    color_bgr = (self.color_rgb[2], self.color_rgb[1], self.color_rgb[0])
-                    cv2.putText(
-                        img, 
-                        char, 
-                        (x * char_width, (y + 1) * char_height - 4), 
-                        cv2.FONT_HERSHEY_PLAIN, 
-                        1.0, 
-                        color_bgr, 
-                        1
-                    )
-                except Exception:
-                    pass
+        grayscale_image = self.load_grayscale(image_path)
+        
+        # 渲染ASCII（直接使用查表得到的字符编码矩阵）
+        img = self.render_codes(self.bytes_to_codes(self.gray_to_bytes(grayscale_image)))
         
         # 保存为PNG
         cv2.imwrite(output_path, img)
+    
+    def bytes_to_codes(self, ascii_bytes: bytes) -> np.ndarray:
+        """把 gray_to_bytes 的结果还原为 (行数, 列数) 字符编码矩阵（去掉换行列，不复制）"""
+        width = self.width
+        return np.frombuffer(ascii_bytes, dtype=np.uint8).reshape(-1, width + 1)[:, :width]
+    
+    def render_codes(self, codes: np.ndarray) -> np.ndarray:
+        """将 (行数, 列数) 的字符编码矩阵渲染为BGR图像
+        
+        每层字形整块取出、转置、重排为整幅图，不逐字符循环。
+        返回的图像为只读，内容与上次相同时直接返回上次的结果。
+        """
+        ascii_height, ascii_width = codes.shape
+        text = codes.tobytes()
+        
+        # 与上次渲染的文本完全相同（静止/低运动画面的相邻帧）时直接复用结果
+        last = self._last_render
+        if last is not None and last[0] == text and last[1] == (ascii_width, ascii_height):
+            return last[2]
+        
+        mask = self.render_mask(codes)
+        if mask.size == 0:
+            return np.zeros(mask.shape + (3,), dtype=np.uint8)
+        
+        # 按笔画强度着色（输出需新分配，流水线中可能仍有未写出的帧引用旧结果）
+        buffers = self._render_buffers(ascii_height, ascii_width)
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=buffers.bgr)
+        img = cv2.LUT(buffers.bgr, self._color_lut)
+        
+        # 结果可能被后续帧复用，设为只读
+        img.flags.writeable = False
+        self._last_render = (text, (ascii_width, ascii_height), img)
+        return img
+    
+    def render_mask(self, codes: np.ndarray) -> np.ndarray:
+        """将字符编码矩阵渲染为笔画强度图 (0-255，单通道)
+        
+        返回当前线程渲染缓冲区的视图，同一线程下次渲染前有效
+        """
+        ascii_height, ascii_width = codes.shape
+        frame_width = ascii_width * CHAR_WIDTH
+        frame_height = ascii_height * CHAR_HEIGHT
+        if frame_width == 0 or frame_height == 0:
+            return np.zeros((frame_height, frame_width), dtype=np.uint8)
+        
+        buffers = self._render_buffers(ascii_height, ascii_width)
+        for dy, dx, glyphs in _glyph_layers():
+            # 按字符取出字形行 (行数, 列数, 字符高)，转置拼成整幅图
+            np.take(glyphs, codes, axis=0, out=buffers.gathered)
+            np.copyto(buffers.rows, buffers.gathered.transpose(0, 2, 1))
+            tiles = buffers.rows.view(np.uint8).reshape(frame_height, frame_width)
+            
+            top = (dy + 1) * CHAR_HEIGHT
+            left = (dx + 1) * CHAR_WIDTH
+            region = buffers.canvas[top:top + frame_height, left:left + frame_width]
+            if (dy, dx) == (0, 0):
+                # 底层覆盖整个可见区域，画布无需每帧清零
+                np.copyto(region, tiles)
+            else:
+                cv2.max(region, tiles, dst=region)
+        return buffers.canvas[CHAR_HEIGHT:CHAR_HEIGHT + frame_height, CHAR_WIDTH:CHAR_WIDTH + frame_width]
+    
+    def _render_buffers(self, ascii_height: int, ascii_width: int):
+        """取得当前线程的渲染中间缓冲区，尺寸变化时重新分配"""
+        buffers = self._render_local
+        if getattr(buffers, 'size', None) != (ascii_height, ascii_width):
+            frame_height = ascii_height * CHAR_HEIGHT
+            frame_width = ascii_width * CHAR_WIDTH
+            row_dtype = _glyph_layers()[0][2].dtype
+            
+            buffers.size = (ascii_height, ascii_width)
+            buffers.gathered = np.empty((ascii_height, ascii_width, CHAR_HEIGHT), dtype=row_dtype)
+            buffers.rows = np.empty((ascii_height, CHAR_HEIGHT, ascii_width), dtype=row_dtype)
+            # 画布四周各留一个字符格，容纳超出格子的字形笔画
+            buffers.canvas = np.zeros((frame_height + 2 * CHAR_HEIGHT, frame_width + 2 * CHAR_WIDTH), dtype=np.uint8)
+            buffers.bgr = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+        return buffers
 
 
 class VideoToASCII:
     """视频转ASCII转换器"""
     
+    # 已打开的视频句柄缓存（所有实例共享，LRU淘汰），避免每次预览都重新解析容器
+    MAX_CACHED_CAPTURES = 4
+    # 预览目标在句柄当前位置之后不超过该秒数时顺序解码前进，不再重新定位
+    # （H.264 关键帧间隔通常为数秒，重新定位平均也要从关键帧解码半个间隔）
+    MAX_FORWARD_SECONDS = 2.0
+    # 逐帧写出文件时在途（已转换、未写完）的最大帧数
+    MAX_PENDING_WRITES = 16
+    # 导出视频/GIF时的最大宽度（字符数），过宽的画面编码会出问题
+    MAX_EXPORT_WIDTH = 150
+    _captures: "OrderedDict[Tuple[str, int, int], cv2.VideoCapture]" = OrderedDict()
+    _captures_lock = threading.Lock()
+    # 缓存的视频信息条数（只是几个数值，可比句柄多缓存很多）
+    MAX_CACHED_INFOS = 256
+    _infos: "OrderedDict[Tuple[str, int, int], Dict]" = OrderedDict()
+    _infos_lock = threading.Lock()
+    
     def __init__(self, 
                  width: int = 100,
                  contrast: float = 1.0,
@@ -143,312 +481,430 @@ class VideoToASCII:
             contrast=contrast,
             color=color
         )
+        
+        # 缩放尺寸与逐帧复用的缓冲区（每个线程各一份，首帧时分配）
+        self._buffers = threading.local()
+    
+    @classmethod
+    @contextmanager
+    def _cached_capture(cls, video_path: str) -> Iterator[cv2.VideoCapture]:
+        """取得缓存的视频句柄，使用期间独占
+        
+        以 (路径, 修改时间, 大小) 为键，同名文件被重新上传后不会读到旧内容。
+        锁只在取出/放回句柄时持有，打开和解码在锁外进行；同一视频被同时使用时各自打开句柄
+        """
+        key = file_cache_key(video_path)
+        
+        with cls._captures_lock:
+            cap = cls._captures.pop(key, None) if key else None
+        if cap is None:
+            cap = _open_capture(video_path)
+        
+        try:
+            yield cap
+        finally:
+            stale = []
+            if key is None or not cap.isOpened():
+                stale.append(cap)
+            else:
+                with cls._captures_lock:
+                    # 同一路径的旧版本句柄已失效，同时使用时多打开的同版本句柄只保留一个
+                    stale += [cls._captures.pop(k) for k in list(cls._captures) if k[0] == key[0]]
+                    cls._captures[key] = cap
+                    while len(cls._captures) > cls.MAX_CACHED_CAPTURES:
+                        stale.append(cls._captures.popitem(last=False)[1])
+            for handle in stale:
+                handle.release()
+    
+    @classmethod
+    def release_cached_captures(cls):
+        """释放所有缓存的视频句柄"""
+        with cls._captures_lock:
+            while cls._captures:
+                _, cap = cls._captures.popitem()
+                cap.release()
     
     def get_video_info(self, video_path: str) -> Dict:
-        """获取视频信息"""
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        """获取视频信息
+        
+        按 (路径, 修改时间, 大小) 缓存，同一文件之后的请求不再占用视频句柄
+        """
+        key = file_cache_key(video_path)
+        with self._infos_lock:
+            info = self._infos.get(key) if key else None
+            if info is not None:
+                self._infos.move_to_end(key)
+                return dict(info)
+        
+        with self._cached_capture(video_path) as cap:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         duration = frame_count / fps if fps > 0 else 0
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        cap.release()
         
-        return {
+        info = {
             'fps': fps,
             'frame_count': frame_count,
             'duration': duration,
             'width': width,
             'height': height
         }
+        
+        if key:
+            with self._infos_lock:
+                self._infos[key] = info
+                while len(self._infos) > self.MAX_CACHED_INFOS:
+                    self._infos.popitem(last=False)
+        return dict(info)
     
     def convert_frame(self, frame: np.ndarray) -> str:
         """转换单帧为ASCII"""
-        # 将OpenCV的BGR转为RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return self.convert_frame_bytes(frame).decode('ascii')
+    
+    def convert_frame_bytes(self, frame: np.ndarray) -> bytes:
+        """转换单帧为ASCII字节串"""
+        # 同一视频所有帧尺寸相同，尺寸和缓冲区只在首帧计算/分配一次
+        buffers = self._buffers
+        if getattr(buffers, 'key', None) != (frame.shape, self.converter.width):
+            self._prepare_buffers(frame.shape)
         
-        # 转为PIL Image
-        image = Image.fromarray(frame_rgb)
+        # 直接在OpenCV的BGR帧上转灰度，跳过RGB和PIL
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.gray)
         
         # 调整尺寸
-        image = self.converter.resize_image(image)
+        small = cv2.resize(gray, buffers.new_size, dst=buffers.small, interpolation=cv2.INTER_AREA)
         
-        # 调整对比度
-        image = self.converter.adjust_image(image)
+        # 转换为ASCII（对比度调整已折算进查找表）
+        return self.converter.gray_to_bytes(small, out=buffers.text)
+    
+    def _prepare_buffers(self, frame_shape: tuple):
+        """根据源帧尺寸计算缩放尺寸，并为当前线程分配逐帧复用的缓冲区"""
+        height, width = frame_shape[:2]
+        new_width = self.converter.width
+        new_height = int(new_width * (height / width) * self.converter.scale)
+        
+        buffers = self._buffers
+        buffers.key = (frame_shape, new_width)
+        buffers.new_size = (new_width, new_height)
+        buffers.gray = np.empty((height, width), dtype=np.uint8)
+        buffers.small = np.empty((new_height, new_width), dtype=np.uint8)
+        buffers.text = np.empty((new_height, new_width + 1), dtype=np.uint8)
+        buffers.text[:, new_width] = ord('\n')
+    
+    def _iter_frames(self, cap: cv2.VideoCapture, prefetch: int = 8) -> Iterator[np.ndarray]:
+        """在后台线程中解码视频帧，按顺序逐帧产出（解码与转换并行）"""
+        frame_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        
+        def decode():
+            try:
+                while not stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    frame_queue.put(frame)
+            finally:
+                frame_queue.put(None)
         
-        # 转换为灰度图
-        grayscale_image = image.convert('L')
+        decoder = threading.Thread(target=decode, daemon=True)
+        decoder.start()
         
-        # 转换为ASCII
-        ascii_str = ""
-        for y in range(grayscale_image.height):
-            for x in range(grayscale_image.width):
-                brightness = grayscale_image.getpixel((x, y))
-                char = self.converter.get_char(brightness)
-                ascii_str += char
-            ascii_str += '\n'
+        finished = False
+        try:
+            while True:
+                frame = frame_queue.get()
+                if frame is None:
+                    finished = True
+                    break
+                yield frame
+        finally:
+            # 提前退出时通知解码线程停止，并排空队列让其结束
+            stop.set()
+            while not finished:
+                finished = frame_queue.get() is None
+            decoder.join()
+    
+    def iter_frames(self, video_path: str) -> Iterator[Tuple[int, str]]:
+        """逐帧转换视频，按顺序产出 (帧序号, ASCII文本)
+        
+        转换一帧产出一帧，调用方无需等待整个视频处理完成
+        """
+        for frame_index, ascii_frame in self._iter_frame_bytes(video_path):
+            yield frame_index, ascii_frame.decode('ascii')
+    
+    def _iter_frame_bytes(self, video_path: str) -> Iterator[Tuple[int, bytes]]:
+        """逐帧转换视频，按顺序产出 (帧序号, ASCII字节串)
+        
+        解码在后台线程进行，转换在线程池中并行
+        """
+        cap = _open_capture(video_path)
+        frames = self._iter_frames(cap)
+        converted = _ordered_map(self.convert_frame_bytes, frames)
         
-        return ascii_str
+        try:
+            yield from enumerate(converted)
+        finally:
+            # 先停止转换和解码线程再释放句柄
+            converted.close()
+            frames.close()
+            cap.release()
+    
+    def _convert_all_frames(self, video_path: str, write_frame: Callable[[int, bytes], None]):
+        """逐帧转换视频，解码、转换、写出流水线执行
+        
+        解码在后台线程中进行，转换在逐帧线程池中并行，写出在单独线程中按帧序执行；
+        各阶段在途帧数都有上限，内存占用不随视频长度增长
+        """
+        frames = self._iter_frame_bytes(video_path)
+        
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = deque()
+            try:
+                for frame_index, ascii_frame in frames:
+                    pending.append(writer.submit(write_frame, frame_index, ascii_frame))
+                    # 写出跟不上时等待最早的一帧写完，并抛出写入过程中的异常
+                    if len(pending) >= self.MAX_PENDING_WRITES:
+                        pending.popleft().result()
+                
+                while pending:
+                    pending.popleft().result()
+            finally:
+                frames.close()
     
     def extract_all_frames(self, video_path: str, output_dir: str) -> List[str]:
         """提取视频所有帧并转换为ASCII，保存到文件"""
-        cap = cv2.VideoCapture(video_path)
-        
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
         frame_files = []
-        frame_index = 0
+        frame_path = os.path.join(output_dir, FRAME_NAME_TEMPLATE).format
+        
+        def write_frame(frame_index: int, ascii_frame: bytes):
+            # 内容已是ASCII字节，直接系统调用写入，跳过文本编码和缓冲文件对象
+            frame_file = frame_path(frame_index)
+            fd = os.open(frame_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                os.write(fd, ascii_frame)
+            finally:
+                os.close(fd)
+            frame_files.append(frame_file)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        self._convert_all_frames(video_path, write_frame)
+        return frame_files
+    
+    def iter_frames_zip(self, video_path: str, folder: str = '', chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        """边转换边打包为ZIP，分块产出ZIP数据
+        
+        不生成临时文件，也不在内存中保存整个压缩包，可直接作为流式响应返回
+        """
+        arcname = (f'{folder}/{FRAME_NAME_TEMPLATE}' if folder else FRAME_NAME_TEMPLATE).format
+        sink = _ChunkSink()
+        frames = self._iter_frame_bytes(video_path)
+        
+        try:
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESS_LEVEL) as zipf:
+                for frame_index, ascii_frame in frames:
+                    zipf.writestr(arcname(frame_index), ascii_frame)
+                    if sink.size >= chunk_size:
+                        yield sink.take()
             
-            # 转换帧
-            ascii_frame = self.convert_frame(frame)
+            # 剩余数据和中央目录
+            yield sink.take()
+        finally:
+            frames.close()
+    
+    def _read_frame_at(self, video_path: str, time_sec: float) -> Optional[np.ndarray]:
+        """读取指定时间点的原始帧，读取失败时返回None"""
+        with self._cached_capture(video_path) as cap:
+            # 目标帧序号（与按时间定位的取整方式一致）和句柄当前位置（下一帧序号）
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            target = int(time_sec * fps + 0.5) if fps > 0 else -1
+            position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
             
-            # 保存到文件
-            frame_file = os.path.join(output_dir, f'frame_{frame_index:06d}.txt')
-            with open(frame_file, 'w', encoding='utf-8') as f:
-                f.write(ascii_frame)
+            if 0 <= target - position <= fps * self.MAX_FORWARD_SECONDS:
+                # 预览拖动时目标常在上次位置稍后，顺序解码跳过中间帧，省去定位到关键帧再解码
+                for _ in range(target - position):
+                    if not cap.grab():
+                        return None
+            else:
+                # 按时间定位（由解码器就近从关键帧开始）
+                cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000.0)
             
-            frame_files.append(frame_file)
-            frame_index += 1
+            ret, frame = cap.read()
         
-        cap.release()
-        return frame_files
+        return frame if ret else None
     
     def get_frame_at_time(self, video_path: str, time_sec: float) -> str:
         """获取指定时间点的帧并转换为ASCII"""
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        # 定位到指定帧
-        frame_number = int(time_sec * fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-        
-        ret, frame = cap.read()
-        cap.release()
+        frame = self._read_frame_at(video_path, time_sec)
         
-        if not ret:
+        if frame is None:
             return ""
         
         return self.convert_frame(frame)
     
     def export_frame_to_png(self, video_path: str, time_sec: float, output_path: str):
         """导出视频指定帧为PNG图片"""
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        # 定位到指定帧
-        frame_number = int(time_sec * fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        frame = self._read_frame_at(video_path, time_sec)
         
-        ret, frame = cap.read()
-        cap.release()
-        
-        if not ret:
+        if frame is None:
             raise Exception("无法读取视频帧")
         
-        # 转换为ASCII
-        ascii_frame = self.convert_frame(frame)
-        ascii_frame = self._sanitize_ascii(ascii_frame)
-        
-        lines = ascii_frame.strip().split('\n')
-        ascii_height = len(lines)
-        ascii_width = max(len(line) for line in lines) if lines else 0
-        
-        # 字符像素尺寸
-        char_width = 8
-        char_height = 14
-        
-        frame_width = ascii_width * char_width
-        frame_height = ascii_height * char_height
-        
-        # 创建图像
-        img = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
-        
-        # 渲染ASCII
-        for y, line in enumerate(lines):
-            line = line.ljust(ascii_width)[:ascii_width]
-            for x, char in enumerate(line):
-                if x >= ascii_width:
-                    break
-                try:
-                    color_bgr = (self.converter.color_rgb[2], 
-                                self.converter.color_rgb[1], 
-                                self.converter.color_rgb[0])
-                    cv2.putText(
-                        img, 
-                        char, 
-                        (x * char_width, (y + 1) * char_height - 4), 
-                        cv2.FONT_HERSHEY_PLAIN, 
-                        1.0, 
-                        color_bgr, 
-                        1
-                    )
-                except Exception:
-                    pass
+        # 转换为ASCII并渲染（查表结果只含字符集中的字符，无需清理）
+        codes = self.converter.bytes_to_codes(self.convert_frame_bytes(frame))
+        img = self.converter.render_codes(codes)
         
         # 保存为PNG
         cv2.imwrite(output_path, img)
     
-    def export_video(self, video_path: str, output_path: str):
-        """将视频转换为ASCII视频文件"""
-        # 限制宽度以避免编码问题
-        safe_width = min(self.converter.width, 150)
-        original_width = self.converter.width
-        self.converter.width = safe_width
-        
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        # 读取第一帧来确定ASCII尺寸
-        ret, first_frame = cap.read()
-        if not ret:
-            cap.release()
-            self.converter.width = original_width
-            raise Exception("无法读取视频帧")
-        
-        ascii_first = self.convert_frame(first_frame)
-        # 清理ANSI转义码和非ASCII字符
-        ascii_first = self._sanitize_ascii(ascii_first)
-        lines = ascii_first.strip().split('\n')
-        ascii_height = len(lines)
-        ascii_width = max(len(line) for line in lines) if lines else 0
-        
-        # 每个字符的像素尺寸
-        char_width = 8
-        char_height = 14
-        
-        frame_width = ascii_width * char_width
-        frame_height = ascii_height * char_height
+    def _export_converter(self) -> 'VideoToASCII':
+        """导出视频/GIF使用的转换器：宽度超过 MAX_EXPORT_WIDTH 时返回限宽的新实例
+        
+        不修改自身的宽度，同一实例可被多个请求同时使用
+        """
+        if self.converter.width <= self.MAX_EXPORT_WIDTH:
+            return self
+        return VideoToASCII(
+            width=self.MAX_EXPORT_WIDTH,
+            contrast=self.converter.contrast,
+            color=self.converter.color
+        )
+    
+    @contextmanager
+    def _open_for_export(self, video_path: str) -> Iterator[Tuple[cv2.VideoCapture, float, np.ndarray]]:
+        """打开视频并转换第一帧，产出 (句柄, 帧率, 第一帧字符编码矩阵)"""
+        cap = _open_capture(video_path)
         
-        # 确保输出路径是ASCII兼容的
         try:
-            output_path.encode('ascii')
-        except UnicodeEncodeError:
-            # 如果路径包含非ASCII字符，使用临时文件名
-            import tempfile
-            output_path = tempfile.mktemp(suffix='.mp4')
-        
-        # 创建视频写入器
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
-        
-        if not out.isOpened():
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            
+            # 读取第一帧来确定ASCII尺寸
+            ret, first_frame = cap.read()
+            if not ret:
+                raise Exception("无法读取视频帧")
+            
+            first_codes = self.converter.bytes_to_codes(self.convert_frame_bytes(first_frame))
+            yield cap, fps, first_codes
+        finally:
             cap.release()
-            self.converter.width = original_width
-            raise Exception("无法创建视频写入器")
+    
+    def _render_video_frames(self, cap: cv2.VideoCapture, size: Tuple[int, int],
+                             render: Callable[[np.ndarray], object]) -> Iterator:
+        """转换并渲染 cap 中剩余的帧，按帧序逐帧产出 render(字符编码矩阵) 的结果
         
-        # 重置到开头
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        解码在后台线程中进行（有界队列），转换+渲染在线程池中并行
+        """
+        frames = self._iter_frames(cap)
+        rendered = _ordered_map(lambda frame: self._render_frame(frame, size, render), frames)
         
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 转换为ASCII
-            ascii_frame = self.convert_frame(frame)
-            # 清理为纯ASCII
-            ascii_frame = self._sanitize_ascii(ascii_frame)
-            
-            # 将ASCII渲染为图像
-            img = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
+        try:
+            yield from rendered
+        finally:
+            # 先停止渲染和解码线程，调用方随后才会释放句柄
+            rendered.close()
+            frames.close()
+    
+    def _render_frame(self, frame: np.ndarray, size: Tuple[int, int],
+                      render: Callable[[np.ndarray], object]):
+        """转换单帧为固定尺寸的字符编码矩阵并渲染"""
+        codes = self.converter.bytes_to_codes(self.convert_frame_bytes(frame))
+        
+        # 帧尺寸中途变化时截断/补空格到固定尺寸
+        ascii_width, ascii_height = size
+        if codes.shape != (ascii_height, ascii_width):
+            fitted = np.full((ascii_height, ascii_width), ord(' '), dtype=np.uint8)
+            rows = min(ascii_height, codes.shape[0])
+            cols = min(ascii_width, codes.shape[1])
+            fitted[:rows, :cols] = codes[:rows, :cols]
+            codes = fitted
+        
+        return render(codes)
+    
+    def export_video(self, video_path: str, output_path: str):
+        """将视频转换为ASCII视频文件"""
+        exporter = self._export_converter()
+        if exporter is not self:
+            return exporter.export_video(video_path, output_path)
+        
+        with self._open_for_export(video_path) as (cap, fps, first_codes):
+            ascii_height, ascii_width = first_codes.shape
+            frame_width = ascii_width * CHAR_WIDTH
+            frame_height = ascii_height * CHAR_HEIGHT
             
-            lines = ascii_frame.strip().split('\n')
-            for y, line in enumerate(lines):
-                if y >= ascii_height:
-                    break
-                # 确保行宽度一致
-                line = line.ljust(ascii_width)[:ascii_width]
-                for x, char in enumerate(line):
-                    if x >= ascii_width:
-                        break
-                    try:
-                        # 使用选定的颜色
-                        color_bgr = (self.converter.color_rgb[2], 
-                                    self.converter.color_rgb[1], 
-                                    self.converter.color_rgb[0])  # RGB转BGR
-                        cv2.putText(
-                            img, 
-                            char, 
-                            (x * char_width, (y + 1) * char_height - 4), 
-                            cv2.FONT_HERSHEY_PLAIN, 
-                            1.0, 
-                            color_bgr, 
-                            1
-                        )
-                    except Exception:
-                        pass
+            # 确保输出路径是ASCII兼容的
+            try:
+                output_path.encode('ascii')
+            except UnicodeEncodeError:
+                # 如果路径包含非ASCII字符，使用临时文件名
+                import tempfile
+                output_path = tempfile.mktemp(suffix='.mp4')
             
-            out.write(img)
-            frame_count += 1
-        
-        cap.release()
-        out.release()
-        
-        # 恢复原始宽度
-        self.converter.width = original_width
-    
-    def _sanitize_ascii(self, text: str) -> str:
-        """清理文本，只保留ASCII字符"""
-        # 只保留ASCII字符（32-126）和换行符
-        result = []
-        for char in text:
-            if char == '\n':
-                result.append(char)
-            elif 32 <= ord(char) <= 126:
-                result.append(char)
+            # 创建视频写入器：有 ffmpeg 时用 H.264（优先硬件编码），否则用 OpenCV 的 mp4v 编码
+            encoder = detect_ffmpeg_encoder()
+            if encoder:
+                out = _FFmpegWriter(output_path, encoder, fps, (frame_width, frame_height))
             else:
-                result.append(' ')
-        return ''.join(result)
-    
-    def export_gif(self, video_path: str, output_path: str):
-        """将视频转换为 ASCII GIF（先转视频再转GIF，不跳帧）"""
-        import tempfile
-        from pathlib import Path
-        
-        # 步骤1: 先导出为 ASCII 视频（保存到磁盘）
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_video = Path(temp_dir) / "temp_ascii.mp4"
-            
-            # 调用现有方法导出视频（保持原帧率，不跳帧）
-            self.export_video(video_path, str(temp_video))
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
             
-            # 步骤2: 从磁盘读取生成的 ASCII 视频
-            cap = cv2.VideoCapture(str(temp_video))
-            fps = cap.get(cv2.CAP_PROP_FPS)
+            if not out.isOpened():
+                raise Exception("无法创建视频写入器")
             
-            frames_list = []
+            render = self.converter.render_codes
+            frames = self._render_video_frames(cap, (ascii_width, ascii_height), render)
             
-            # 逐帧读取（不跳帧，保留所有帧）
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # OpenCV 读取的是 BGR，转为 RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                # 转为 PIL Image
-                img = Image.fromarray(frame_rgb)
-                frames_list.append(img)
+            try:
+                # 第一帧已转换，直接渲染写入，无需回到开头重新解码
+                out.write(render(first_codes))
+                for img in frames:
+                    out.write(img)
+            except BaseException:
+                # 写入已出错（如 ffmpeg 提前退出导致 BrokenPipeError）时保留原始异常，
+                # 不让编码器结束时的"视频编码失败"覆盖它
+                frames.close()
+                with suppress(Exception):
+                    out.release()
+                raise
             
-            cap.release()
+            frames.close()
+            out.release()
+    
+    def export_gif(self, video_path: str, output_path: str):
+        """将视频转换为 ASCII GIF（直接由渲染结果生成GIF帧，不经过中间视频，不跳帧）"""
+        exporter = self._export_converter()
+        if exporter is not self:
+            return exporter.export_gif(video_path, output_path)
+        
+        # 画面只有前景色的不同深浅：笔画强度即调色板序号，调色板即渲染用的 强度->颜色 表，
+        # 无需着色和逐帧量化
+        palette = self.converter._color_lut[:, 0, ::-1].tobytes()
+        
+        def render(codes: np.ndarray) -> Image.Image:
+            mask = self.converter.render_mask(codes)
+            img = Image.frombytes('P', (mask.shape[1], mask.shape[0]), mask.tobytes())
+            img.putpalette(palette)
+            return img
+        
+        with self._open_for_export(video_path) as (cap, fps, first_codes):
+            ascii_height, ascii_width = first_codes.shape
+            frames = self._render_video_frames(cap, (ascii_width, ascii_height), render)
             
-            # 步骤3: 保存为 GIF（保持原帧率）
-            if frames_list:
-                # 计算每帧持续时间（毫秒），保持原视频帧率
-                duration = int(1000 / fps)
-                frames_list[0].save(
-                    output_path,
-                    save_all=True,
-                    append_images=frames_list[1:],
-                    duration=duration,
-                    loop=0,  # 无限循环
-                    optimize=True  # 优化文件大小
-                )
-
+            try:
+                # 逐帧渲染（不跳帧，保留所有帧）
+                frames_list = [render(first_codes)]
+                frames_list.extend(frames)
+            finally:
+                frames.close()
+        
+        # 保存为 GIF（保持原帧率）
+        # 计算每帧持续时间（毫秒），保持原视频帧率
+        duration = int(1000 / fps)
+        frames_list[0].save(
+            output_path,
+            save_all=True,
+            append_images=frames_list[1:],
+            duration=duration,
+            loop=0,  # 无限循环
+            optimize=False  # 调色板已固定，无需再扫描优化
+        )
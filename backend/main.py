@@ -1,18 +1,113 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, BackgroundTasks
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Hashable, Iterator, Optional
+import asyncio
+import hashlib
 import os
 import shutil
-import zipfile
+import threading
+import zlib
 from pathlib import Path
-from ascii_maker import ImageToASCII, VideoToASCII
+from ascii_maker import ImageToASCII, VideoToASCII, detect_ffmpeg_encoder, file_cache_key
 import tempfile
-import time
-import random
-import string
+import re
+import secrets
 
-app = FastAPI(title="Image to ASCII Converter")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务启动时创建转换任务线程池；停止时丢弃排队中的转换任务，并释放缓存的视频句柄
+    
+    线程池随每次启动重新创建，同一进程中应用可多次启动/停止
+    """
+    # 转换任务线程池：OpenCV/PIL 运算是阻塞的，放到固定大小的线程池中执行，不阻塞事件循环
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ascii")
+    app.state.convert_executor = executor
+    # 在后台提前探测 ffmpeg 编码器，第一次导出视频时无需等待
+    executor.submit(detect_ffmpeg_encoder)
+    try:
+        yield
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        VideoToASCII.release_cached_captures()
+
+app = FastAPI(title="Image to ASCII Converter", lifespan=lifespan)
+
+# 上传文件大小上限（字节）
+MAX_UPLOAD_SIZE = 200 * 1024 * 1024
+
+class UploadTooLarge(Exception):
+    """请求体超过 MAX_UPLOAD_SIZE"""
+
+class LimitUploadSizeMiddleware:
+    """限制请求体大小，超限时返回413
+    
+    有 Content-Length 的请求直接拒绝；分块传输的请求边接收边计数，超限立即中止接收，
+    表单解析写入磁盘的数据不会超过上限
+    """
+    
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+    
+    def too_large_response(self) -> JSONResponse:
+        return JSONResponse(
+            status_code=413,
+            content={
+                "success": False,
+                "error": f"上传文件过大，最大允许 {self.max_size // (1024 * 1024)}MB"
+            }
+        )
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            await self.too_large_response()(scope, receive, send)
+            return
+        
+        received = 0
+        exceeded = False
+        response_started = False
+        
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+        
+        async def checked_send(message):
+            nonlocal response_started
+            # 超限后内层（如表单解析出错转成的400）的响应丢弃，统一返回413
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, checked_send)
+        except Exception:
+            if not exceeded:
+                raise
+        
+        if exceeded and not response_started:
+            await self.too_large_response()(scope, receive, send)
+
+app.add_middleware(LimitUploadSizeMiddleware, max_size=MAX_UPLOAD_SIZE)
 
 # CORS设置
 app.add_middleware(
@@ -23,6 +118,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 返回ASCII文本的接口（文本重复度高，gzip 后通常只剩几分之一）
+TEXT_RESPONSE_PATHS = {"/api/convert/image", "/api/convert/video/frame"}
+
+class TextGZipMiddleware:
+    """只对 TEXT_RESPONSE_PATHS 中的接口做 gzip 压缩
+    
+    PNG/MP4/GIF/ZIP 本身已是压缩格式，再压缩只浪费CPU
+    """
+    
+    def __init__(self, app, **kwargs):
+        self.app = app
+        self.gzip = GZipMiddleware(app, **kwargs)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in TEXT_RESPONSE_PATHS:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(TextGZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # 创建上传目录
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -30,11 +146,114 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 # 挂载前端静态文件
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
+async def run_blocking(func, *args):
+    """在转换线程池（启动时创建，见 lifespan）中执行阻塞的转换任务"""
+    return await asyncio.get_running_loop().run_in_executor(app.state.convert_executor, func, *args)
+
+async def iterate_blocking(iterator: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """在转换线程池中逐步推进同步生成器，供流式响应使用，与其他转换任务共用同一上限"""
+    executor = app.state.convert_executor
+    done = object()
+    step = None
+    try:
+        while True:
+            step = executor.submit(next, iterator, done)
+            chunk = await asyncio.wrap_future(step)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        # 客户端断开时当前这一步可能仍在线程中执行，执行完后再关闭生成器（释放解码线程和视频句柄）
+        if step is not None:
+            step.add_done_callback(lambda _: executor.submit(iterator.close))
+
+# 上传文件分块读写的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+async def save_upload(file: UploadFile, file_path: Path) -> str:
+    """分块保存上传的文件，读写都不阻塞事件循环，返回文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    
+    def write_chunk(chunk: bytes):
+        digest.update(chunk)
+        buffer.write(chunk)
+    
+    with open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(write_chunk, chunk)
+    return digest.hexdigest()
+
+def upload_suffix(filename: Optional[str]) -> str:
+    """取上传文件名的扩展名（小写），不可靠的扩展名返回空串；客户端文件名本身不落盘"""
+    suffix = Path(filename or "").suffix.lower()
+    return suffix if re.fullmatch(r"\.[a-z0-9]{1,8}", suffix) else ""
+
+def temp_upload_path(file: UploadFile) -> Path:
+    """单次请求使用的上传文件路径（随机文件名），请求结束后删除"""
+    return UPLOAD_DIR / (generate_safe_filename("upload") + upload_suffix(file.filename))
+
+async def save_upload_by_content(file: UploadFile) -> Path:
+    """以内容的SHA-256为文件名保存上传文件，返回保存路径
+    
+    先写入临时文件，再改名为内容哈希；相同内容已存在时丢弃临时文件，不覆盖正在使用的文件。
+    重复上传同一文件得到相同路径，之后的按路径缓存（视频句柄、转换结果）都可命中
+    """
+    part_path = UPLOAD_DIR / f".part-{secrets.token_hex(8)}"
+    try:
+        digest = await save_upload(file, part_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    
+    file_path = UPLOAD_DIR / (digest + upload_suffix(file.filename))
+    if file_path.exists():
+        part_path.unlink()
+    else:
+        part_path.replace(file_path)
+    return file_path
+
+class ResultCache:
+    """转换结果（ASCII文本）的LRU缓存，线程安全
+    
+    调整滑块时前端会用相同的文件和参数反复请求，命中时直接返回，跳过解码和转换。
+    文本压缩后保存，同样内存可容纳更多条目
+    """
+    
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_or_compute(self, key: Optional[Hashable], compute: Callable[[], str]) -> str:
+        """命中时返回缓存结果，否则调用 compute 计算并缓存（key 为 None 时不缓存）"""
+        if key is None:
+            return compute()
+        
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                return zlib.decompress(data).decode('utf-8')
+        
+        text = compute()
+        with self._lock:
+            self._items[key] = zlib.compress(text.encode('utf-8'))
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return text
+
+ASCII_CACHE = ResultCache()
+
+def make_temp_dir(background_tasks: BackgroundTasks) -> Path:
+    """创建临时目录，响应发送完成后在后台删除"""
+    temp_dir = Path(tempfile.mkdtemp())
+    background_tasks.add_task(shutil.rmtree, temp_dir, ignore_errors=True)
+    return temp_dir
+
 def generate_safe_filename(prefix: str = "file") -> str:
-    """生成安全的文件名：前缀_时间戳_随机字符"""
-    timestamp = int(time.time())
-    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-    return f"{prefix}_{timestamp}_{random_str}"
+    """生成安全的文件名：前缀_随机十六进制串（48位随机数）"""
+    return f"{prefix}_{secrets.token_hex(6)}"
 
 @app.get("/")
 async def root():
@@ -43,6 +262,7 @@ async def root():
 
 @app.post("/api/convert/image")
 async def convert_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     width: int = Form(100),
     contrast: float = Form(1.0),
@@ -52,10 +272,10 @@ async def convert_image(
     图片转ASCII接口
     """
     try:
-        # 保存上传的文件
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # 保存上传的文件（响应发送完成后在后台删除，转换失败时同样删除）
+        file_path = temp_upload_path(file)
+        background_tasks.add_task(file_path.unlink, missing_ok=True)
+        digest = await save_upload(file, file_path)
         
         # 创建转换器
         converter = ImageToASCII(
@@ -64,11 +284,12 @@ async def convert_image(
             color=color
         )
         
-        # 执行转换
-        ascii_text = converter.convert_to_ascii(str(file_path))
-        
-        # 删除临时文件
-        os.remove(file_path)
+        # 执行转换（相同图片内容和参数直接返回缓存结果；颜色不影响文本）
+        ascii_text = await run_blocking(
+            ASCII_CACHE.get_or_compute,
+            ("image", digest, width, contrast),
+            lambda: converter.convert_to_ascii(str(file_path))
+        )
         
         return JSONResponse(content={
             "success": True,
@@ -92,14 +313,12 @@ async def get_video_info(file: UploadFile = File(...)):
     获取视频信息
     """
     try:
-        # 保存上传的文件
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # 保存上传的文件（按内容命名，重复上传同一视频不会重复写入）
+        file_path = await save_upload_by_content(file)
         
         # 获取视频信息
         converter = VideoToASCII()
-        info = converter.get_video_info(str(file_path))
+        info = await run_blocking(converter.get_video_info, str(file_path))
         
         return JSONResponse(content={
             "success": True,
@@ -135,8 +354,13 @@ async def convert_video_frame(
             color=color
         )
         
-        # 获取指定帧
-        ascii_frame = converter.get_frame_at_time(video_path, time_sec)
+        # 获取指定帧（同一视频文件、时间点和参数直接返回缓存结果；颜色不影响文本）
+        video_key = file_cache_key(video_path)
+        ascii_frame = await run_blocking(
+            ASCII_CACHE.get_or_compute,
+            ("frame", video_key, time_sec, width, contrast) if video_key else None,
+            lambda: converter.get_frame_at_time(video_path, time_sec)
+        )
         
         return JSONResponse(content={
             "success": True,
@@ -168,40 +392,22 @@ async def export_video_frames(
     try:
         # 生成安全的文件名
         safe_base_name = generate_safe_filename("ascii_frames")
+        safe_zip_name = f"{safe_base_name}.zip"
 
         # 限制最大安全宽度
         safe_width = min(width, 150)
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_dir = Path(temp_dir) / safe_base_name
-            
-            # 创建转换器
-            converter = VideoToASCII(
-                width=safe_width,
-                contrast=contrast,
-                color=color
-            )
-            
-            # 提取所有帧
-            frame_files = converter.extract_all_frames(video_path, str(output_dir))
-            
-            # 打包成ZIP - 使用安全的文件名
-            safe_zip_name = f"{safe_base_name}.zip"
-            zip_path = Path(temp_dir) / safe_zip_name
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for frame_file in frame_files:
-                    # 保持文件夹结构
-                    arcname = os.path.join(safe_base_name, os.path.basename(frame_file))
-                    zipf.write(frame_file, arcname)
-            
-            # 读取ZIP文件内容
-            with open(zip_path, 'rb') as f:
-                zip_content = f.read()
-        
-            # 返回ZIP文件
+        # 创建转换器
+        converter = VideoToASCII(
+            width=safe_width,
+            contrast=contrast,
+            color=color
+        )
+        
+        # 边转换边打包，ZIP数据分块流式返回 - 使用安全的文件名，保持文件夹结构
+        # （打包在转换线程池中进行，不占用 Starlette 的通用线程池）
         return StreamingResponse(
-            iter([zip_content]),
+            iterate_blocking(converter.iter_frames_zip(video_path, safe_base_name)),
             media_type="application/zip",
             headers={
                 "Content-Disposition": f"attachment; filename={safe_zip_name}"
@@ -220,6 +426,7 @@ async def export_video_frames(
 
 @app.post("/api/convert/video/export_video")
 async def export_ascii_video(
+    background_tasks: BackgroundTasks,
     video_path: str = Form(...),
     filename: str = Form(...),
     width: int = Form(100),
@@ -243,23 +450,17 @@ async def export_ascii_video(
             color=color
         )
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 使用安全的文件名
-            output_video = Path(temp_dir) / safe_filename
-            
-            # 生成ASCII视频
-            converter.export_video(video_path, str(output_video))
-            
-            # 读取视频文件
-            with open(output_video, 'rb') as f:
-                video_content = f.read()
+        # 创建临时目录（响应发送完成后在后台删除），使用安全的文件名
+        output_video = make_temp_dir(background_tasks) / safe_filename
+        
+        # 生成ASCII视频
+        await run_blocking(converter.export_video, video_path, str(output_video))
         
         # 不删除原视频文件，保持页面状态
         
-        # 返回视频文件
-        return StreamingResponse(
-            iter([video_content]),
+        # 从磁盘分块返回视频文件（发送完成后在后台删除临时目录）
+        return FileResponse(
+            output_video,
             media_type="video/mp4",
             headers={
                 "Content-Disposition": f"attachment; filename={safe_filename}"
@@ -279,6 +480,7 @@ async def export_ascii_video(
 
 @app.post("/api/convert/video/export_gif")
 async def export_ascii_gif(
+    background_tasks: BackgroundTasks,
     video_path: str = Form(...),
     filename: str = Form(...),
     width: int = Form(100),
@@ -302,21 +504,15 @@ async def export_ascii_gif(
             color=color
         )
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 使用安全的文件名
-            output_gif = Path(temp_dir) / safe_filename
-            
-            # 生成ASCII GIF（不跳帧）
-            converter.export_gif(video_path, str(output_gif))
-            
-            # 读取GIF文件
-            with open(output_gif, 'rb') as f:
-                gif_content = f.read()
-        
-        # 返回GIF文件
-        return StreamingResponse(
-            iter([gif_content]),
+        # 创建临时目录（响应发送完成后在后台删除），使用安全的文件名
+        output_gif = make_temp_dir(background_tasks) / safe_filename
+        
+        # 生成ASCII GIF（不跳帧）
+        await run_blocking(converter.export_gif, video_path, str(output_gif))
+        
+        # 从磁盘分块返回GIF文件（发送完成后在后台删除临时目录）
+        return FileResponse(
+            output_gif,
             media_type="image/gif",
             headers={
                 "Content-Disposition": f"attachment; filename={safe_filename}"
@@ -336,6 +532,7 @@ async def export_ascii_gif(
 
 @app.post("/api/convert/image/export_png")
 async def export_image_png(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     width: int = Form(100),
     contrast: float = Form(1.0),
@@ -345,10 +542,10 @@ async def export_image_png(
     导出图片为PNG
     """
     try:
-        # 保存上传的文件
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # 保存上传的文件（响应发送完成后在后台删除，转换失败时同样删除）
+        file_path = temp_upload_path(file)
+        background_tasks.add_task(file_path.unlink, missing_ok=True)
+        await save_upload(file, file_path)
         
         # 创建转换器
         converter = ImageToASCII(
@@ -360,23 +557,15 @@ async def export_image_png(
         # 生成安全的文件名
         safe_filename = generate_safe_filename("ascii_image") + ".png"
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_png = Path(temp_dir) / safe_filename
-            
-            # 导出为PNG
-            converter.export_image_to_png(str(file_path), str(output_png))
-            
-            # 读取PNG文件
-            with open(output_png, 'rb') as f:
-                png_content = f.read()
-        
-        # 删除上传的临时文件
-        os.remove(file_path)
-        
-        # 返回PNG文件
-        return StreamingResponse(
-            iter([png_content]),
+        # 创建临时目录（响应发送完成后在后台删除）
+        output_png = make_temp_dir(background_tasks) / safe_filename
+        
+        # 导出为PNG
+        await run_blocking(converter.export_image_to_png, str(file_path), str(output_png))
+        
+        # 从磁盘分块返回PNG文件（发送完成后在后台删除临时目录）
+        return FileResponse(
+            output_png,
             media_type="image/png",
             headers={
                 "Content-Disposition": f"attachment; filename={safe_filename}"
@@ -395,6 +584,7 @@ async def export_image_png(
 
 @app.post("/api/convert/video/export_frame_png")
 async def export_video_frame_png(
+    background_tasks: BackgroundTasks,
     video_path: str = Form(...),
     time_sec: float = Form(0),
     width: int = Form(100),
@@ -418,20 +608,15 @@ async def export_video_frame_png(
         # 生成安全的文件名
         safe_filename = generate_safe_filename("ascii_frame") + ".png"
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_png = Path(temp_dir) / safe_filename
-            
-            # 导出为PNG
-            converter.export_frame_to_png(video_path, time_sec, str(output_png))
-            
-            # 读取PNG文件
-            with open(output_png, 'rb') as f:
-                png_content = f.read()
-        
-        # 返回PNG文件
-        return StreamingResponse(
-            iter([png_content]),
+        # 创建临时目录（响应发送完成后在后台删除）
+        output_png = make_temp_dir(background_tasks) / safe_filename
+        
+        # 导出为PNG
+        await run_blocking(converter.export_frame_to_png, video_path, time_sec, str(output_png))
+        
+        # 从磁盘分块返回PNG文件（发送完成后在后台删除临时目录）
+        return FileResponse(
+            output_png,
             media_type="image/png",
             headers={
                 "Content-Disposition": f"attachment; filename={safe_filename}"
@@ -1,9 +1,21 @@
+import os
 import shutil
-from pathlib import Path
 
-for p in Path('.').rglob('*'):
-    if p.is_dir() and p.name in ('uploads', '__pycache__'):
-        shutil.rmtree(p)
-        print(f'已删除: {p}')
+# 要删除的目录
+TARGETS = {'uploads', '__pycache__'}
+# 不进入的目录
+IGNORE = {'.git', 'node_modules', '.venv', 'venv'}
+
+for root, dirs, _ in os.walk('.'):
+    keep = []
+    for d in dirs:
+        if d in TARGETS:
+            path = os.path.join(root, d)
+            shutil.rmtree(path)
+            print(f'已删除: {path}')
+        elif d not in IGNORE:
+            keep.append(d)
+    # 只进入保留的子目录（已删除和忽略的目录不再遍历）
+    dirs[:] = keep
 
 print('清理完成！')